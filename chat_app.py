@@ -1,23 +1,76 @@
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
 import os
 import datetime
+import ast
 import json
+import orjson
 import re
+import time
+from hashlib import blake2b
 from google import genai
+from PIL import Image
 # from dotenv import load_dotenv
 import random
 import smtplib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 # Load environment variables
 # load_dotenv()
 
+# Markdown code fences Gemini sometimes wraps JSON in
+_JSON_FENCE = re.compile(r'```json\s*|\s*```')
+
+# Gemini prompt templates (filled with str.format_map)
+_LIST_PROMPT = (
+    "Act as Sarah, the hotel concierge.\n"
+    "Guest Name: {last_name}\n"
+    "Stay: {check_in} to {check_out}\n"
+    "Activities Available:\n{stay_activities}\n\n"
+    "Request: Provide the complete list of activities for their stay schedule.\n"
+    "Requirements:\n"
+    "1. Return ONLY a JSON array of objects. Do not include any markdown formatting or extra text.\n"
+    "2. Each object must have keys: 'day', 'date', 'time', 'activity_name', 'price', 'description'.\n"
+    "3. Do NOT generate an image URL. Images are handled locally.\n"
+)
+
+_PERSONALIZE_PROMPT = (
+    "Act as Sarah, the dedicated and knowledgeable hotel concierge at Jumeirah Beach Hotel.\n"
+    "Guest Profile: {guest_profile}\n"
+    "Activities Available:\n{stay_activities}\n"
+    "Context: The guest asked for personalized recommendations and just replied: '{user_input}'\n\n"
+    "Task: Carefully analyze the guest's profile (especially Age, Gender, and Family Members) and their request. Select the best matching activities from the available list.\n"
+    "Requirements:\n"
+    "1. Return ONLY a JSON array of objects. Do not include any markdown formatting or extra text.\n"
+    "2. Each object must have keys: 'day', 'date', 'time', 'activity_name', 'price', 'description'.\n"
+    "3. Do NOT generate an image URL. Images are handled locally.\n"
+    "4. STRICTLY MATCH INTERESTS: Check the 'Tags' column in the activities. If the user asks for 'relax', look for 'Wellness', 'Spa', 'Relax'. If 'party', look for 'Social', 'Alcohol', 'Nightlife'.\n"
+    "5. STRICTLY ENFORCE CONSTRAINTS: Check 'Min_Age' and 'Target_Gender' against the Guest Profile. Do not recommend activities the guest (or their children) cannot attend.\n"
+    "6. If the user mentions a specific day or time, prioritize those.\n"
+)
+
+_FOLLOW_UP_PROMPT = "Act as Sarah, hotel concierge. The user is asking a follow-up question. Be helpful and brief."
+
+# Keyword -> intent table for stage transitions (no LLM round-trip needed)
+_WORD = re.compile(r"[a-z]+")
+_INTENT_TABLE = {
+    "list": "LIST", "schedule": "LIST",
+    "no": "END", "nope": "END", "not": "END",  # Whole words only, so "know" isn't a "no"
+}
+# Matched as word prefixes: personally, personalization, customize, ...
+_PERSONALIZE_PREFIXES = ("personal", "custom")
+
 # Configure page
 st.set_page_config(page_title="Hotel Concierge", page_icon="🏨")
 
 # Initialize Gemini
+GEMINI_MODEL = 'gemini-2.0-flash-exp'
 api_key = st.secrets.get("GEMINI_API_KEY")
 client = None
 if api_key:
@@ -28,16 +81,35 @@ else:
 # ==========================================
 # DATA LOADING
 # ==========================================
+GUEST_COLUMNS = [
+    "Guest_ID", "Last_Name", "Room_Number", "Check_In", "Check_Out",
+    "Primary_Age", "Primary_Gender", "Group_Type", "Family_Members",
+]
+
+# Columns read as raw text; Arrow would otherwise reformat dates/times (e.g. 07:00 -> 07:00:00)
+GUEST_TEXT_COLUMNS = ["Guest_ID", "Room_Number", "Check_In", "Check_Out"]
+SCHEDULE_TEXT_COLUMNS = ["Date", "Start_Time"]
+
+def _read_csv_arrow(path, text_columns, columns=None):
+    """Read a CSV with Arrow, keeping text_columns exactly as written in the file."""
+    convert_options = pa_csv.ConvertOptions(
+        column_types={col: pa.string() for col in text_columns},
+        include_columns=columns or [],  # Empty means all columns
+    )
+    return pa_csv.read_csv(path, convert_options=convert_options).to_pandas(types_mapper=pd.ArrowDtype)
+
 @st.cache_data
 def load_data():
     try:
-        # Load Guests
-        guests = pd.read_csv("guest_data.csv")
-        # Ensure ID is string
-        guests["Guest_ID"] = guests["Guest_ID"].astype(str)
+        # Load Guests (Arrow parser, only the columns the concierge uses)
+        # Ensure ID/room are strings and stay dates are left as text for the prompts
+        guests = _read_csv_arrow("guest_data.csv", GUEST_TEXT_COLUMNS, GUEST_COLUMNS)
         
         # Load Schedule
-        schedule = pd.read_csv("hotel_schedule.csv")
+        schedule = _read_csv_arrow("hotel_schedule.csv", SCHEDULE_TEXT_COLUMNS)
+        # Combine Date and Start_Time once, sorted so stay windows can be sliced
+        schedule["Activity_DateTime"] = pd.to_datetime(schedule["Date"].astype(str) + " " + schedule["Start_Time"].astype(str))
+        schedule = schedule.sort_values("Activity_DateTime", kind="stable").reset_index(drop=True)
         return guests, schedule
     except Exception as e:
         st.error(f"Error loading data: {e}")
@@ -45,6 +117,11 @@ def load_data():
 
 df_guests, df_schedule = load_data()
 
+@st.cache_resource
+def _guest_records():
+    """Guest rows as plain dicts, built once so LOGIN is a simple list pick."""
+    return df_guests.to_dict("records")
+
 # ==========================================
 # SESSION STATE
 # ==========================================
@@ -60,31 +137,57 @@ if "guest_info" not in st.session_state:
 if "booking_request" not in st.session_state:
     st.session_state.booking_request = None
 
+if "pending_emails" not in st.session_state:
+    st.session_state.pending_emails = []  # Futures for confirmation emails still in flight
+
 
 
 # ==========================================
 # HELPER FUNCTIONS
 # ==========================================
-def get_guest_schedule(check_in, check_out):
-    """Filter hotel schedule for the guest's stay."""
+# Schedule fields worth sending to Gemini
+PROMPT_COLUMNS = ["Day_Name", "Date", "Start_Time", "Activity_Name", "Type", "Price", "Tags", "Min_Age", "Target_Gender"]
+
+def _prefilter(stay_schedule, guest):
+    """Drop activities nobody in the party can attend and trim fields to shrink the prompt."""
+    # Ages/genders of everyone in the party, not just the primary guest
+    try:
+        members = ast.literal_eval(str(guest.get("Family_Members") or "[]"))
+    except (ValueError, SyntaxError):
+        members = []
+    party = [{"Age": guest.get("Primary_Age"), "Gender": guest.get("Primary_Gender")}] + list(members)
+    max_age = max((m.get("Age") or 0) for m in party)
+    genders = ["Any"] + [m.get("Gender") for m in party]
+
+    mask = (stay_schedule["Min_Age"].fillna(0) <= max_age) & stay_schedule["Target_Gender"].isin(genders)
+    return stay_schedule.loc[mask, PROMPT_COLUMNS]
+
+def get_guest_schedule(check_in, check_out, guest):
+    """Filter hotel schedule for the guest's stay, as a JSON string ready for the prompts."""
     try:
         # Convert check-in/out to datetime objects
         cin_dt = pd.to_datetime(check_in)
         cout_dt = pd.to_datetime(check_out)
         
-        # Create a full datetime column for the schedule
-        # Combine Date and Start_Time
-        df_schedule['Activity_DateTime'] = pd.to_datetime(df_schedule['Date'].astype(str) + ' ' + df_schedule['Start_Time'].astype(str))
-        
-        # Filter based on exact timing
         # Activity must start AFTER check-in and BEFORE check-out
-        mask = (df_schedule['Activity_DateTime'] >= cin_dt) & (df_schedule['Activity_DateTime'] <= cout_dt)
-        stay_schedule = df_schedule.loc[mask].drop(columns=['Activity_DateTime'])
+        # Schedule is pre-sorted by Activity_DateTime in load_data
+        activity_times = df_schedule['Activity_DateTime']
+        lo = activity_times.searchsorted(cin_dt, side='left')
+        hi = activity_times.searchsorted(cout_dt, side='right')
+        stay_schedule = _prefilter(df_schedule.iloc[lo:hi], guest)
         
-        return stay_schedule.to_dict('records')
+        return stay_schedule.to_json(orient='records')
     except Exception as e:
         return f"Error processing schedule: {e}"
 
+def detect_intents(user_input):
+    """Return the set of intents whose keywords appear in the message."""
+    words = _WORD.findall(user_input.lower())
+    intents = {_INTENT_TABLE[word] for word in words if word in _INTENT_TABLE}
+    if any(word.startswith(_PERSONALIZE_PREFIXES) for word in words):
+        intents.add("PERSONALIZE")
+    return intents
+
 def generate_ai_response(user_input, context_prompt=""):
     """Call Gemini to generate response."""
     if not client:
@@ -93,59 +196,196 @@ def generate_ai_response(user_input, context_prompt=""):
     try:
         full_prompt = f"{context_prompt}\n\nUser Message: {user_input}"
         response = client.models.generate_content(
-            model='gemini-2.0-flash-exp',
+            model=GEMINI_MODEL,
             contents=full_prompt
         )
         return response.text
     except Exception as e:
         return f"I apologize, I'm having trouble connecting right now. ({e})"
 
+def stream_ai_response(user_input, context_prompt="", min_chars=50, max_wait=0.02):
+    """Stream Gemini text, batching chunks so the UI isn't redrawn per token."""
+    if not client:
+        yield "I'm sorry, my language core is offline (API Key missing)."
+        return
+    
+    try:
+        full_prompt = f"{context_prompt}\n\nUser Message: {user_input}"
+        buffer = ""
+        last_flush = time.monotonic()
+        for chunk in client.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            contents=full_prompt
+        ):
+            buffer += chunk.text or ""
+            # Flush once enough text has arrived or it has waited long enough
+            if len(buffer) >= min_chars or time.monotonic() - last_flush >= max_wait:
+                yield buffer
+                buffer = ""
+                last_flush = time.monotonic()
+        if buffer:
+            yield buffer
+    except Exception as e:
+        yield f"I apologize, I'm having trouble connecting right now. ({e})"
+
 def parse_json_response(text):
     """Extract and parse JSON from LLM response."""
     try:
-        # Clean up markdown code blocks if present
-        cleaned_text = re.sub(r'```json\s*|\s*```', '', text).strip()
-        return json.loads(cleaned_text)
+        # Fast path: bare JSON needs no cleanup
+        if text.lstrip()[:1] in ("[", "{"):
+            cleaned_text = text.strip()
+        else:
+            # Clean up markdown code blocks if present
+            cleaned_text = _JSON_FENCE.sub('', text).strip()
+
+        try:
+            result = orjson.loads(cleaned_text)
+        except orjson.JSONDecodeError:
+            # stdlib is more lenient (e.g. NaN/Infinity literals)
+            result = json.loads(cleaned_text)
     except Exception:
         return None
 
-def get_activity_image(activity_name):
-    """Find local image for activity."""
+    # Precompute per-activity booking fields once, off the click path
+    if isinstance(result, list):
+        for act in result:
+            if isinstance(act, dict):
+                act["_is_free"] = str(act.get("price", "")).strip().lower() == "free"
+                # Short stable widget key from title/date/time
+                key_src = f"{act.get('activity_name', 'Activity')}|{act.get('date', '')}|{act.get('time', '')}"
+                act["_key"] = "b" + blake2b(key_src.encode(), digest_size=6).hexdigest()
+    return result
+
+@st.cache_data(ttl=3600)
+def cached_schedule_json(last_name, check_in, check_out, activities_key):
+    """Ask Gemini to format the stay schedule as activity cards, cached per stay.
+
+    Raises ValueError with the raw reply when it is not valid JSON, so failed
+    responses are never cached.
+    """
+    # Context for Gemini to format the list
+    prompt = _LIST_PROMPT.format_map(dict(
+        last_name=last_name, check_in=check_in, check_out=check_out, stay_activities=activities_key
+    ))
+    # Fixed request instead of the guest's own words, so the reply depends only on the cache key
+    raw_response = generate_ai_response("Please list the activities for my stay.", prompt)
+    parsed_json = parse_json_response(raw_response)
+    if not parsed_json:
+        raise ValueError(raw_response)
+    return parsed_json
+
+def _thumbnail(image_dir, filename):
+    """Return a <=800px WEBP copy of an activity image, creating it on first use."""
+    src = os.path.join(image_dir, filename)
+    out = os.path.join(image_dir, "_thumbs", os.path.splitext(filename)[0] + ".webp")
+    if os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(src):
+        return out
+    tmp = out + ".tmp"
+    try:
+        with Image.open(src) as im:
+            im.thumbnail((800, 800))
+            im.save(tmp, "WEBP", quality=80)
+        # Only a fully written file takes the thumbnail's name
+        os.replace(tmp, out)
+        return out
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return src # Serve the original if it can't be converted
+
+@st.cache_resource
+def _activity_image_index():
+    """Build a {normalized_name: image_path} map of local activity images (thumbnails when possible) once per process."""
     image_dir = "activities"
     if not os.path.exists(image_dir):
-        return None
-    
-    # Normalize activity name
-    target = activity_name.lower().replace(" ", "")
-    
-    # Special mappings if needed
-    if "yoga" in target: return os.path.join(image_dir, "yoga.png")
-    if "happyhour" in target: return os.path.join(image_dir, "happyhour.png")
-    
+        return {}
+    try:
+        os.makedirs(os.path.join(image_dir, "_thumbs"), exist_ok=True)
+        image_path = _thumbnail
+    except OSError:
+        # Read-only deploy: index the original images instead
+        image_path = os.path.join
+
+    # Special mappings first so they win the substring fallback
+    index = {
+        "yoga": image_path(image_dir, "yoga.png"),
+        "happyhour": image_path(image_dir, "happyhour.png"),
+    }
     for filename in os.listdir(image_dir):
         if filename.startswith("."): continue # Skip hidden files
-        
+        if not os.path.isfile(os.path.join(image_dir, filename)): continue # Skip _thumbs
+
         # Normalize filename (remove extension)
         base_name = os.path.splitext(filename)[0].lower().replace(" ", "")
-        
-        # Check for match
-        if base_name in target or target in base_name:
-             return os.path.join(image_dir, filename)
-             
-    return None
+        if base_name not in index:
+            index[base_name] = image_path(image_dir, filename)
+    return index
 
-def send_booking_confirmation_email(guest_info, activity, ref_number):
-    """Send booking details to admin email."""
-    # Force reload env to pick up changes without restarting server entirely if possible
-    # load_dotenv(override=True)
-    
-    sender_email = st.secrets.get("SMTP_EMAIL")
+def get_activity_image(activity_name):
+    """Find local image for activity."""
+    index = _activity_image_index()
+
+    # Normalize activity name
+    target = activity_name.lower().replace(" ", "")
+
+    if target in index:
+        return index[target]
+    return next((path for base_name, path in index.items() if base_name in target or target in base_name), None)
+
+SMTPConfig = namedtuple("SMTPConfig", ["sender_email", "sender_password", "smtp_server", "smtp_port", "receiver_email"])
+
+@st.cache_resource
+def _smtp_config():
+    """Read SMTP settings from secrets once per process."""
     password_raw = st.secrets.get("SMTP_PASSWORD", "")
-    sender_password = password_raw.replace(" ", "") # Remove spaces from App Password
-    
-    smtp_server = st.secrets.get("SMTP_SERVER", "smtp.gmail.com")
-    smtp_port = int(st.secrets.get("SMTP_PORT", 587))
-    receiver_email = "fayas@innobaytsolutions.com"
+    return SMTPConfig(
+        sender_email=st.secrets.get("SMTP_EMAIL"),
+        sender_password=password_raw.replace(" ", ""), # Remove spaces from App Password
+        smtp_server=st.secrets.get("SMTP_SERVER", "smtp.gmail.com"),
+        smtp_port=int(st.secrets.get("SMTP_PORT", 587)),
+        receiver_email="fayas@innobaytsolutions.com",
+    )
+
+def _smtp_connection(sessions, config):
+    """Return this thread's SMTP session, reconnecting if it has gone stale."""
+    server = getattr(sessions, "server", None)
+    if server is not None:
+        try:
+            server.noop()
+            return server
+        except (smtplib.SMTPException, OSError):
+            _drop_smtp_connection(sessions)
+
+    server = smtplib.SMTP(config.smtp_server, config.smtp_port)
+    try:
+        server.starttls()
+        server.login(config.sender_email, config.sender_password)
+    except Exception:
+        server.close() # Not stored yet, so _drop_smtp_connection can't close it
+        raise
+    sessions.server = server
+    return server
+
+def _drop_smtp_connection(sessions):
+    """Close and forget this thread's SMTP session so the next send reconnects."""
+    server = getattr(sessions, "server", None)
+    sessions.server = None
+    if server is not None:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+def send_booking_confirmation_email(guest_info, activity, ref_number, config=None, sessions=None):
+    """Send booking details to admin email.
+
+    sessions is the thread-local holding the worker's SMTP session; without it
+    a one-off connection is opened and closed.
+    """
+    config = config or _smtp_config()
+    reuse = sessions is not None
+    sessions = sessions if reuse else threading.local()
+    sender_email, sender_password, receiver_email = config.sender_email, config.sender_password, config.receiver_email
     # Construct Message
     subject = f"New Booking: {guest_info.get('Last_Name')} - Room {guest_info.get('Room_Number')}"
     
@@ -176,30 +416,88 @@ def send_booking_confirmation_email(guest_info, activity, ref_number):
         msg['Subject'] = subject
         msg.attach(MIMEText(body, 'plain'))
 
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_email, sender_password)
+        # Reuse the thread's logged-in session instead of a new TLS handshake per email
+        server = _smtp_connection(sessions, config)
         server.sendmail(sender_email, receiver_email, msg.as_string())
-        server.quit()
+        if not reuse:
+            _drop_smtp_connection(sessions)
         return True, "Email sent successfully"
     except Exception as e:
+        _drop_smtp_connection(sessions)
         return False, str(e)
 
+@st.cache_resource
+def _mailer():
+    """Background pool so SMTP round-trips never block a rerun."""
+    pool = ThreadPoolExecutor(max_workers=2)
+    # Per-worker SMTP sessions live with the pool, shared across reruns
+    pool.smtp_sessions = threading.local()
+    return pool
+
+def queue_booking_confirmation_email(guest_info, activity, ref_number):
+    """Send the confirmation email in the background; results are reported on a later rerun."""
+    # Resolve secrets and session holder on the script thread; the worker only does the SMTP round-trip
+    pool = _mailer()
+    future = pool.submit(
+        send_booking_confirmation_email, guest_info, activity, ref_number, _smtp_config(), pool.smtp_sessions
+    )
+    st.session_state.pending_emails.append(future)
+
+def report_finished_emails():
+    """Surface the outcome of any background confirmation emails that have completed."""
+    still_pending = []
+    for future in st.session_state.pending_emails:
+        if not future.done():
+            still_pending.append(future)
+            continue
+
+        try:
+            success, status = future.result()
+        except Exception as e:
+            success, status = False, str(e)
+
+        if success:
+            st.toast("Confirmation email sent!", icon="📧")
+        else:
+            # Log failure to chat history so it persists
+            error_msg = f"⚠️ **Booking Confirmed locally, but Email Failed.**\nError: `{status}`"
+            st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            print(f"Email failed: {status}")
+    st.session_state.pending_emails = still_pending
+
+def _poll_emails():
+    """Fragment body: report finished emails, redrawing the app when something changed.
+
+    A full rerun shows any failure added to history and, once nothing is in
+    flight, rebuilds this fragment without run_every so polling stops.
+    """
+    history_len = len(st.session_state.messages)
+    had_pending = bool(st.session_state.pending_emails)
+    report_finished_emails()
+    drained = had_pending and not st.session_state.pending_emails
+    if drained or len(st.session_state.messages) != history_len:
+        st.rerun()
+
+def resolve_activity_images(activities):
+    """Store each activity's image path on the payload so reruns skip the lookup."""
+    for act in activities:
+        # Try local image first
+        local_img = get_activity_image(act.get('activity_name', 'Activity'))
+        act['_img'] = local_img or act.get('image', 'https://via.placeholder.com/800x600?text=No+Image')
+    return activities
+
 def render_activity_cards(activities):
     """Render activities using native Streamlit containers."""
     for act in activities:
         # Fallbacks
         title = act.get('activity_name', 'Activity')
         
-        # Try local image first
-        local_img = get_activity_image(title)
-        if local_img:
-            img_url = local_img
-        else:
-            img_url = act.get('image', 'https://via.placeholder.com/800x600?text=No+Image')
+        if '_img' not in act:
+            resolve_activity_images([act])
+        img_url = act['_img']
             
         date = act.get('date', '')
-        time = act.get('time', '')
+        act_time = act.get('time', '')
         price = act.get('price', '')
         desc = act.get('description', '')
 
@@ -211,14 +509,13 @@ def render_activity_cards(activities):
             
             with col2:
                 st.subheader(title)
-                st.caption(f"📅 {date} | ⏰ {time}")
+                st.caption(f"📅 {date} | ⏰ {act_time}")
                 st.markdown(f"**{price}**")
                 st.write(desc)
                 
                 # Unique key for the button is critical
-                # We use a combination of fields to ensure uniqueness
-                btn_key = f"book_{title}_{date}_{time}".replace(" ", "_")
-                if st.button("Book Now", key=btn_key):
+                # Built from title/date/time in parse_json_response to ensure uniqueness
+                if st.button("Book Now", key=act["_key"]):
                     st.session_state.booking_request = act
                     st.rerun()
 
@@ -272,9 +569,10 @@ st.markdown("""
 # Automatically select a random guest for the demo
 if st.session_state.chat_stage == "LOGIN":
     # Pick a random guest
-    if not df_guests.empty:
-        random_guest = df_guests.sample(n=1).iloc[0]
-        st.session_state.guest_info = random_guest.to_dict()
+    guest_records = _guest_records()
+    if guest_records:
+        # Copy so a session never mutates the shared cached record
+        st.session_state.guest_info = dict(random.choice(guest_records))
         st.session_state.chat_stage = "GREETING"
         st.rerun()
     else:
@@ -282,6 +580,9 @@ if st.session_state.chat_stage == "LOGIN":
 
 # --- CHAT INTERFACE ---
 else:
+    # Report confirmation emails as they finish; poll only while some are in flight
+    st.fragment(_poll_emails, run_every="2s" if st.session_state.pending_emails else None)()
+
     # Handle Booking Request (processed before rendering to update history immediately)
     if st.session_state.booking_request:
         act = st.session_state.booking_request
@@ -290,16 +591,13 @@ else:
         user_msg = f"I would like to book **{act.get('activity_name')}** for {act.get('price')}."
         st.session_state.messages.append({"role": "user", "content": user_msg})
         
-        # Check if Free
-        price_str = str(act.get('price', '')).lower().strip()
-        is_free = (price_str == "free")
-        
-        if is_free:
+        # Check if Free (flag set in parse_json_response)
+        if act.get("_is_free"):
             # Auto-confirm
             ref_num = f"{random.randint(100000, 999999)}"
             
-            # Send Email
-            success, status = send_booking_confirmation_email(st.session_state.guest_info, act, ref_num)
+            # Send Email (in the background)
+            queue_booking_confirmation_email(st.session_state.guest_info, act, ref_num)
             
             # Add Success Message directly
             success_msg = (
@@ -309,12 +607,7 @@ else:
                 f"We have sent a confirmation details to the front desk."
             )
             st.session_state.messages.append({"role": "assistant", "content": success_msg})
-            
-            if success:
-                 st.toast("Confirmation email sent!", icon="📧")
-            else:
-                 print(f"Email failed: {status}")
-                 st.error(f"Email Failed: {status}")
+            st.toast("Booking confirmed, email queued", icon="📧")
 
             # Clear request
             st.session_state.booking_request = None
@@ -326,7 +619,8 @@ else:
                 "role": "assistant", 
                 "content": act,
                 "type": "payment_request",
-                "paid": False
+                "paid": False,
+                "_key": f"pay_btn_{len(st.session_state.messages)}"
             })
             
             # Clear request
@@ -334,9 +628,15 @@ else:
             st.rerun()
 
     # Display Chat History
+    # Card lists superseded by a newer card list are collapsed; the latest stays open
+    card_indexes = [i for i, m in enumerate(st.session_state.messages) if m.get("type") == "json_cards"]
+    latest_cards = card_indexes[-1] if card_indexes else None
     for i, msg in enumerate(st.session_state.messages):
         with st.chat_message(msg["role"]):
-            if msg.get("type") == "json_cards":
+            if msg.get("type") == "json_cards" and i != latest_cards:
+                with st.expander("Previous recommendations", expanded=False):
+                    render_activity_cards(msg["content"])
+            elif msg.get("type") == "json_cards":
                 render_activity_cards(msg["content"])
             elif msg.get("type") == "payment_request":
                 act = msg["content"]
@@ -346,23 +646,16 @@ else:
                     st.caption(f"Ref: {ref_num}")
                 else:
                     st.write(f"Excellent choice! Please confirm your booking for **{act.get('activity_name')}**.")
-                    if st.button("Tap to Pay & Confirm 💳", key=f"pay_btn_{i}"):
+                    if st.button("Tap to Pay & Confirm 💳", key=msg.get("_key", f"pay_btn_{i}")):
                         msg["paid"] = True
                         
                         # Generate Reference
                         ref_num = f"{random.randint(100000, 999999)}"
                         msg["ref_num"] = ref_num
                         
-                        # Send Email
-                        success, status = send_booking_confirmation_email(st.session_state.guest_info, act, ref_num)
-                        
-                        if success:
-                            st.toast("Confirmation email sent!", icon="📧")
-                        else:
-                            # Log failure to chat history so it persists
-                            error_msg = f"⚠️ **Booking Confirmed locally, but Email Failed.**\nError: `{status}`"
-                            st.session_state.messages.append({"role": "assistant", "content": error_msg})
-                            print(f"Email failed: {status}") 
+                        # Send Email (in the background)
+                        queue_booking_confirmation_email(st.session_state.guest_info, act, ref_num)
+                        st.toast("Booking confirmed, email queued", icon="📧")
 
                         st.rerun()
             else:
@@ -384,19 +677,22 @@ else:
     if user_input := st.chat_input("Type your response here..."):
         # 1. Add User Message
         st.session_state.messages.append({"role": "user", "content": user_input})
+        # Drawn now so the question is visible while Gemini works
         with st.chat_message("user"):
             st.markdown(user_input)
 
         # 2. Process Assistant Response
         response_text = ""
         is_json_response = False
+        is_streamed = False
         parsed_activities = []
+        intents = detect_intents(user_input)
         
         # STATE: OFFER_HELP -> PREFERENCE
         if st.session_state.chat_stage == "OFFER_HELP":
             # Simple check for Yes/No
-            # In a real app, we'd use LLM to classify intent, but simple keyword matching works for "Yes/No"
-            if any(word in user_input.lower() for word in ['no', 'nope', 'not now']):
+            # Local keyword matching is enough here; Gemini is only called to generate content
+            if "END" in intents:
                 response_text = "Certainly. Please feel free to reach out if you change your mind. Enjoy your stay!"
                 st.session_state.chat_stage = "ENDED"
             else:
@@ -406,44 +702,35 @@ else:
                 )
                 st.session_state.chat_stage = "PREFERENCE"
 
-        # STATE: PREFERENCE -> PERSONALIZE or LIST
+        # STATE: PREFERENCE -> PERSONALIZE, LIST or END
         elif st.session_state.chat_stage == "PREFERENCE":
-            if "personal" in user_input.lower():
+            if "PERSONALIZE" in intents:
                 response_text = (
                     "I'd love to curate something special for you. Could you tell me a bit more about what you're in the mood for? "
                     "For example: Are you looking for relaxation, adventure, family fun, or dining experiences?"
                 )
                 st.session_state.chat_stage = "PERSONALIZE_Q_AND_A"
+            elif "END" in intents and "LIST" not in intents:
+                # "No thanks" -- skip the Gemini list call ("no, just the list" still lists)
+                response_text = "Certainly. Please feel free to reach out if you change your mind. Enjoy your stay!"
+                st.session_state.chat_stage = "ENDED"
             else:
-                # Default to List
+                # LIST, or default to List
                 # Generate List
                 check_in = st.session_state.guest_info['Check_In']
                 check_out = st.session_state.guest_info['Check_Out']
-                stay_activities = get_guest_schedule(check_in, check_out)
-                
-                # Context for Gemini to format the list
-                prompt = (
-                    f"Act as Sarah, the hotel concierge.\n"
-                    f"Guest Name: {st.session_state.guest_info['Last_Name']}\n"
-                    f"Stay: {check_in} to {check_out}\n"
-                    f"Activities Available:\n{stay_activities}\n\n"
-                    "Request: Provide the complete list of activities for their stay schedule.\n"
-                    "Requirements:\n"
-                    "1. Return ONLY a JSON array of objects. Do not include any markdown formatting or extra text.\n"
-                    "2. Each object must have keys: 'day', 'date', 'time', 'activity_name', 'price', 'description'.\n"
-                    "3. Do NOT generate an image URL. Images are handled locally.\n"
-                )
+                # JSON string, so it doubles as the cache key
+                activities_key = get_guest_schedule(check_in, check_out, st.session_state.guest_info)
                 
                 with st.spinner("Retrieving your schedule..."):
-                    raw_response = generate_ai_response(user_input, prompt)
-                    parsed_json = parse_json_response(raw_response)
-                    
-                    if parsed_json:
+                    try:
+                        parsed_activities = cached_schedule_json(
+                            st.session_state.guest_info['Last_Name'], check_in, check_out, activities_key
+                        )
                         is_json_response = True
-                        parsed_activities = parsed_json
                         response_text = "Here are the activities available during your stay:"
-                    else:
-                        response_text = raw_response # Fallback to text if JSON fails
+                    except ValueError as e:
+                        response_text = str(e) # Fallback to text if JSON fails
 
                 st.session_state.chat_stage = "RESULT"
 
@@ -455,22 +742,11 @@ else:
              check_in = st.session_state.guest_info['Check_In']
              check_out = st.session_state.guest_info['Check_Out']
              guest_profile = st.session_state.guest_info
-             stay_activities = get_guest_schedule(check_in, check_out)
+             stay_activities = get_guest_schedule(check_in, check_out, guest_profile)
              
-             prompt = (
-                f"Act as Sarah, the dedicated and knowledgeable hotel concierge at Jumeirah Beach Hotel.\n"
-                f"Guest Profile: {guest_profile}\n"
-                f"Activities Available:\n{stay_activities}\n"
-                f"Context: The guest asked for personalized recommendations and just replied: '{user_input}'\n\n"
-                "Task: Carefully analyze the guest's profile (especially Age, Gender, and Family Members) and their request. Select the best matching activities from the available list.\n"
-                "Requirements:\n"
-                "1. Return ONLY a JSON array of objects. Do not include any markdown formatting or extra text.\n"
-                "2. Each object must have keys: 'day', 'date', 'time', 'activity_name', 'price', 'description'.\n"
-                "3. Do NOT generate an image URL. Images are handled locally.\n"
-                "4. STRICTLY MATCH INTERESTS: Check the 'Tags' column in the activities. If the user asks for 'relax', look for 'Wellness', 'Spa', 'Relax'. If 'party', look for 'Social', 'Alcohol', 'Nightlife'.\n"
-                "5. STRICTLY ENFORCE CONSTRAINTS: Check 'Min_Age' and 'Target_Gender' against the Guest Profile. Do not recommend activities the guest (or their children) cannot attend.\n"
-                "6. If the user mentions a specific day or time, prioritize those.\n"
-            )
+             prompt = _PERSONALIZE_PROMPT.format_map(dict(
+                guest_profile=guest_profile, stay_activities=stay_activities, user_input=user_input
+             ))
              
              with st.spinner("Curating your personalized itinerary..."):
                  raw_response = generate_ai_response(user_input, prompt)
@@ -489,23 +765,21 @@ else:
         else:
              # Just continue conversation or handle additional questions
              # Pass history context if possible in a real app, keeping it simple here
-             response_text = generate_ai_response(user_input, 
-                "Act as Sarah, hotel concierge. The user is asking a follow-up question. Be helpful and brief."
-             )
+             # Free text, so stream it rather than waiting for the full reply
+             with st.chat_message("assistant"):
+                 response_text = st.write_stream(stream_ai_response(user_input, _FOLLOW_UP_PROMPT))
+             is_streamed = True
 
         # 3. Display Assistant Response
         if response_text:
-            if is_json_response:
-                # Append text intro
-                st.session_state.messages.append({"role": "assistant", "content": response_text})
+            # Text intro (or the whole reply)
+            st.session_state.messages.append({"role": "assistant", "content": response_text})
+            if not is_streamed:
                 with st.chat_message("assistant"):
                     st.markdown(response_text)
-                
-                # Append JSON cards for history
-                st.session_state.messages.append({"role": "assistant", "content": parsed_activities, "type": "json_cards"})
+
+            if is_json_response:
+                # JSON cards for history
+                st.session_state.messages.append({"role": "assistant", "content": resolve_activity_images(parsed_activities), "type": "json_cards"})
                 with st.chat_message("assistant"):
                     render_activity_cards(parsed_activities)
-            else:
-                st.session_state.messages.append({"role": "assistant", "content": response_text})
-                with st.chat_message("assistant"):
-                    st.markdown(response_text)
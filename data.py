@@ -1,6 +1,11 @@
 import pandas as pd
 import datetime
+import os
 import random
+import time
+
+# Rewrite the CSVs at most once a day when imported (always when run directly)
+MAX_DATA_AGE = 86400
 
 # ==========================================
 # 1. DEFINE THE ACTIVITY POOL (The "Menu")
@@ -29,32 +34,33 @@ activity_pool = [
 # ==========================================
 # 2. GENERATE THE 30-DAY SCHEDULE
 # ==========================================
-schedule_rows = []
-start_date = datetime.date.today()
+def build_schedule():
+    """Expand the activity pool into a 30-day schedule starting today."""
+    schedule_rows = []
+    start_date = datetime.date.today()
 
-for day_offset in range(30):
-    current_date = start_date + datetime.timedelta(days=day_offset)
-    day_of_week = current_date.weekday() # 0=Monday, 6=Sunday
-    
-    # Check every activity in the pool
-    for activity in activity_pool:
-        # If the activity is scheduled for this day of the week
-        if day_of_week in activity["Days"]:
-            schedule_rows.append({
-                "Date": current_date.strftime("%Y-%m-%d"),
-                "Day_Name": current_date.strftime("%A"),
-                "Activity_Name": activity["Name"],
-                "Type": activity["Type"],
-                "Start_Time": activity["Time"],
-                "Tags": activity["Tags"],
-                "Price": activity["Price"],
-                "Min_Age": activity["Min_Age"],
-                "Target_Gender": activity.get("Target_Gender", "Any")
-            })
-
-# Create DataFrame
-df_30_day_schedule = pd.DataFrame(schedule_rows)
-df_schedule = df_30_day_schedule
+    for day_offset in range(30):
+        current_date = start_date + datetime.timedelta(days=day_offset)
+        day_of_week = current_date.weekday() # 0=Monday, 6=Sunday
+        
+        # Check every activity in the pool
+        for activity in activity_pool:
+            # If the activity is scheduled for this day of the week
+            if day_of_week in activity["Days"]:
+                schedule_rows.append({
+                    "Date": current_date.strftime("%Y-%m-%d"),
+                    "Day_Name": current_date.strftime("%A"),
+                    "Activity_Name": activity["Name"],
+                    "Type": activity["Type"],
+                    "Start_Time": activity["Time"],
+                    "Tags": activity["Tags"],
+                    "Price": activity["Price"],
+                    "Min_Age": activity["Min_Age"],
+                    "Target_Gender": activity.get("Target_Gender", "Any")
+                })
+
+    # Create DataFrame
+    return pd.DataFrame(schedule_rows)
 
 # ==========================================
 # TABLE 2: GUEST DATA (10 Records)
@@ -97,33 +103,45 @@ guest_data = {
 # ==========================================
 # 2.1 ADD CHECK-IN / CHECK-OUT (Dynamic)
 # ==========================================
-# We simulate check-in based on today's date so data is always relevant
-base_time = datetime.datetime.now().replace(hour=14, minute=0, second=0, microsecond=0)
-check_ins = []
-check_outs = []
-
-# Mock arrival offsets relative to today (0 means checking in today, -1 means yesterday)
-# This ensures some guests are partially through their stay
-arrival_offsets = [0, -1, 0, -2, -1, -3, 0, 0, 1, -1]
-
-for i, duration in enumerate(guest_data["Duration_Stay"]):
-    # Check In
-    check_in_dt = base_time + datetime.timedelta(days=arrival_offsets[i])
-    check_ins.append(check_in_dt.strftime("%Y-%m-%d %H:%M"))
-    
-    # Check Out
-    check_out_dt = check_in_dt + datetime.timedelta(days=duration)
-    # Assume 11 AM check out
-    check_out_dt = check_out_dt.replace(hour=11, minute=0)
-    check_outs.append(check_out_dt.strftime("%Y-%m-%d %H:%M"))
+def build_guests():
+    """Guest table with check-in/out dates relative to now."""
+    # We simulate check-in based on today's date so data is always relevant
+    base_time = datetime.datetime.now().replace(hour=14, minute=0, second=0, microsecond=0)
+    check_ins = []
+    check_outs = []
 
-guest_data["Check_In"] = check_ins
-guest_data["Check_Out"] = check_outs
+    # Mock arrival offsets relative to today (0 means checking in today, -1 means yesterday)
+    # This ensures some guests are partially through their stay
+    arrival_offsets = [0, -1, 0, -2, -1, -3, 0, 0, 1, -1]
 
+    for i, duration in enumerate(guest_data["Duration_Stay"]):
+        # Check In
+        check_in_dt = base_time + datetime.timedelta(days=arrival_offsets[i])
+        check_ins.append(check_in_dt.strftime("%Y-%m-%d %H:%M"))
+        
+        # Check Out
+        check_out_dt = check_in_dt + datetime.timedelta(days=duration)
+        # Assume 11 AM check out
+        check_out_dt = check_out_dt.replace(hour=11, minute=0)
+        check_outs.append(check_out_dt.strftime("%Y-%m-%d %H:%M"))
+
+    return pd.DataFrame({**guest_data, "Check_In": check_ins, "Check_Out": check_outs})
+
+def _is_stale(path):
+    """True if the file is missing or older than MAX_DATA_AGE."""
+    return not os.path.exists(path) or (time.time() - os.path.getmtime(path)) > MAX_DATA_AGE
 
-df_guests = pd.DataFrame(guest_data)
-df_guests.to_csv("guest_data.csv", index=False)
-df_schedule.to_csv("hotel_schedule.csv", index=False)
+
+if __name__ == "__main__" or _is_stale("guest_data.csv") or _is_stale("hotel_schedule.csv"):
+    df_guests = build_guests()
+    df_30_day_schedule = build_schedule()
+    df_guests.to_csv("guest_data.csv", index=False)
+    df_30_day_schedule.to_csv("hotel_schedule.csv", index=False)
+else:
+    # Fresh files: importers get exactly what is on disk, no rebuild
+    df_guests = pd.read_csv("guest_data.csv", dtype={"Room_Number": str})
+    df_30_day_schedule = pd.read_csv("hotel_schedule.csv")
+df_schedule = df_30_day_schedule
 # print(df_guests)
 # ==========================================
 # 3. DISPLAY RESULTS